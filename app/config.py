@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -9,6 +11,30 @@ class Settings(BaseSettings):
     DRIVE_FOLDER_ID: str
     PORT: int = 8000
 
+    # Subcarpetas de DRIVE_FOLDER_ID: "fecha" (año/mes), "empresa" o "ninguno"
+    DRIVE_SHARDING: Literal["fecha", "empresa", "ninguno"] = "fecha"
+    DRIVE_FOLDER_CACHE_PATH: str = "drive_folders_cache.json"
+
+    # Perfil de salida de los PDFs: "estandar" o "pdfa"
+    PDF_PERFIL: Literal["estandar", "pdfa"] = "estandar"
+
+    # Pre-renderizado especulativo de certificados desde /verificar-cedula
+    PRERENDER_ENABLED: bool = True
+    PRERENDER_TIPO_CONTRATO: str = "de Obra o Labor contratada"
+    PRERENDER_MAX_ENTRIES: int = 32
+    PRERENDER_TTL_SECONDS: int = 300
+    PRERENDER_MAX_WORKERS: int = 2
+    PRERENDER_WAIT_SECONDS: float = 10.0
+
+    # Perfilado opcional por solicitud (ver app/profiling.py)
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.05
+    PROFILING_INTERVAL: float = 0.001
+    PROFILING_DIR: str = "profiles"
+    PROFILING_MAX_RECENT: int = Field(200, gt=0)
+    PROFILING_HEADER: str = "X-Profile-Token"
+    PROFILING_TOKEN: Optional[str] = None
+
     model_config = SettingsConfigDict(env_file=".env")
 
 settings = Settings()
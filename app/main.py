@@ -1,14 +1,18 @@
-from fastapi import FastAPI, Request, Form, HTTPException
-# V-- NUEVA LÍNEA: Importar StaticFiles
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Form, HTTPException, Query
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
+from brotli_asgi import BrotliMiddleware
+from app.config import settings
+from app.profiling import middleware_perfilado, perfilable, etapa, solicitudes_mas_lentas, token_valido
+from app.static_files import CachedStaticFiles, STATIC_DIR, url_estatico
 from app.services import sheets_service, drive_service
+from app.services.prerender_service import prerender_cache, PrerenderCancelado
 from app.services.template import generar_certificado_en_memoria
 from datetime import datetime
 from collections import defaultdict
-from typing import Optional
+from typing import Optional, Dict, List, Tuple
 import re
+import threading
 import locale
 from num2words import num2words
 
@@ -23,32 +27,55 @@ except locale.Error:
 
 
 app = FastAPI()
+# El middleware de perfilado solo se instala si puede llegar a usarse
+if settings.PROFILING_ENABLED or settings.PROFILING_TOKEN:
+    app.middleware("http")(middleware_perfilado)
+# Comprime las respuestas con brotli, o con gzip si el navegador no acepta brotli
+app.add_middleware(BrotliMiddleware, minimum_size=500, gzip_fallback=True)
 
 # --- BLOQUE AÑADIDO ---
 # Monta la carpeta 'static' que está dentro de 'app' en la ruta URL '/static'
 # Ahora el navegador puede acceder a los archivos pidiendo, por ejemplo, http://127.0.0.1:8000/static/mi_imagen.svg
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 # --- FIN DEL BLOQUE AÑADIDO ---
 
 
 templates = Jinja2Templates(directory="app/templates")
+# Las plantillas compiladas se cachean; en producción no se revisa el disco en cada render
+templates.env.auto_reload = settings.environment != "production"
+templates.env.globals["url_estatico"] = url_estatico
 
 @app.get("/", response_class=HTMLResponse)
 def read_root(request: Request):
     """Muestra el formulario para ingresar la cédula."""
-    return templates.TemplateResponse("form.html", {"request": request})
+    return templates.TemplateResponse(request, "form.html")
+
+@app.get("/admin/perfiles")
+def listar_perfiles(request: Request, limite: int = Query(20, ge=1)):
+    """
+    Lista las solicitudes recientes más lentas con su desglose por etapa
+    y, si fueron muestreadas, la ruta del perfil guardado.
+    """
+    if not settings.PROFILING_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_valido(request):
+        raise HTTPException(status_code=403, detail="Token de perfilado inválido")
+
+    return JSONResponse(content={"solicitudes": solicitudes_mas_lentas(limite)})
 
 # ... (el resto del archivo main.py permanece exactamente igual) ...
 # (No es necesario que lo pegues aquí, solo asegúrate de que el resto del código siga ahí)
 
 @app.post("/verificar-cedula")
+@perfilable
 def verificar_cedula(cedula: str = Form(...)):
     """
     Endpoint para verificar información preliminar de una cédula.
     Retorna último cargo y estado del contrato.
     """
     # Buscar todos los registros de la cédula
-    records = sheets_service.get_records_by_cedula(cedula)
+    with etapa("sheets"):
+        records = sheets_service.get_records_by_cedula(cedula)
     if not records:
         raise HTTPException(status_code=404, detail=f"No se encontró ningún registro para la cédula {cedula}")
     
@@ -64,6 +91,19 @@ def verificar_cedula(cedula: str = Form(...)):
     # Determinar si el contrato está activo (Fecha de Retiro vacía)
     contrato_activo = not (fecha_retiro and str(fecha_retiro).strip())
     
+    # Pre-renderizar en segundo plano con las entradas más probables (tipo de
+    # contrato por defecto y salario de la hoja) mientras el usuario completa el formulario
+    if settings.PRERENDER_ENABLED:
+        tipo_contrato = settings.PRERENDER_TIPO_CONTRATO
+        prerender_cache.programar(
+            cedula,
+            clave_prerender(tipo_contrato, None),
+            lambda cancelado: renderizar_certificados(
+                cedula, records, sheets_service.get_company_info_lookup(),
+                tipo_contrato, None, cancelado
+            )
+        )
+    
     return JSONResponse(content={
         "ultimo_cargo": ultimo_cargo,
         "contrato_activo": contrato_activo
@@ -123,25 +163,17 @@ def numero_a_letras(salario_str: str) -> str:
     except Exception:
         return "Salario no válido"
 
-@app.post("/generar", response_class=HTMLResponse)
-def generate_pdf_and_upload(cedula: str = Form(...), salario_manual: Optional[str] = Form(None),tipo_contrato: str = Form(...)):
+def renderizar_certificados(cedula: str, records: List[Dict], company_info_lookup: Dict[str, Dict[str, str]],
+                            tipo_contrato: str, salario_manual: Optional[str],
+                            cancelado: Optional[threading.Event] = None) -> List[Dict]:
     """
-    Orquesta la generación y subida de múltiples certificados con lógica de negocio avanzada.
-    1. Busca TODOS los registros por cédula en Google Sheets.
-    2. Agrupa los contratos por empresa canónica.
-    3. Genera un PDF por cada empresa con lógica condicional.
-    4. Sube cada PDF a Google Drive.
-    5. Devuelve enlaces a todos los archivos subidos.
-    """
-    # 1. Buscar TODOS los registros por cédula en Google Sheets
-    records = sheets_service.get_records_by_cedula(cedula)
-    if not records:
-        raise HTTPException(status_code=404, detail=f"No se encontró ningún registro para la cédula {cedula}")
-
-    # 2. Obtener diccionario de información de empresas para normalización
-    company_info_lookup = sheets_service.get_company_info_lookup()
+    Genera en memoria un PDF por cada empresa canónica, sin subir nada a Drive.
 
-    # 3. Agrupar contratos por nombre canónico de empresa
+    Returns:
+        Lista de diccionarios con "empresa", "filename" y "pdf_bytes", o con
+        "empresa" y "error" si falló la generación de esa empresa.
+    """
+    # 1. Agrupar contratos por nombre canónico de empresa
     contracts_by_canonical_company = defaultdict(list)
     for record in records:
         # Obtener nombre crudo de la empresa desde bd_contratacion
@@ -159,11 +191,15 @@ def generate_pdf_and_upload(cedula: str = Form(...), salario_manual: Optional[st
         
         contracts_by_canonical_company[canonical_name].append(record)
 
-    # 4. Generar certificados por empresa (usando nombres canónicos)
-    generated_files = []
+    # 2. Generar certificados por empresa (usando nombres canónicos)
+    certificados = []
     now = datetime.now()
     
     for canonical_company_name, contracts in contracts_by_canonical_company.items():
+        # Un pre-renderizado especulativo se abandona en cuanto sus entradas dejan de servir
+        if cancelado is not None and cancelado.is_set():
+            raise PrerenderCancelado(cedula)
+
         try:
             # Obtener nombre del empleado (usar el del primer contrato)
             nombre_completo = contracts[0].get("Nombre del empleado", "Desconocido")
@@ -263,188 +299,100 @@ def generate_pdf_and_upload(cedula: str = Form(...), salario_manual: Optional[st
             }
             
             # Generar PDF en memoria
-            pdf_bytes = generar_certificado_en_memoria(datos_plantilla)
+            pdf_bytes = generar_certificado_en_memoria(datos_plantilla, perfil=settings.PDF_PERFIL)
             
             # Crear nombre de archivo descriptivo usando nombre canónico
             company_safe = canonical_company_name.replace(' ', '_').replace(',', '').replace('/', '_')
             pdf_filename = f"Certificado_{nombre_completo.replace(' ', '_')}_{company_safe}_{cedula}.pdf"
             
-            # Subir a Google Drive
-            file_info = drive_service.upload_pdf(pdf_bytes, pdf_filename)
+            certificados.append({
+                "empresa": canonical_company_name,
+                "filename": pdf_filename,
+                "pdf_bytes": pdf_bytes
+            })
+            
+        except Exception as e:
+            # Si hay error con una empresa, continuar con las otras
+            certificados.append({
+                "empresa": canonical_company_name,
+                "error": str(e)
+            })
+
+    return certificados
+
+def clave_prerender(tipo_contrato: str, salario_manual: Optional[str]) -> Tuple:
+    """Entradas que determinan el contenido de los certificados de una cédula."""
+    return (tipo_contrato, salario_manual or "", datetime.now().date().isoformat())
+
+@app.post("/generar", response_class=HTMLResponse)
+@perfilable
+def generate_pdf_and_upload(request: Request, cedula: str = Form(...), salario_manual: Optional[str] = Form(None),tipo_contrato: str = Form(...)):
+    """
+    Orquesta la generación y subida de múltiples certificados con lógica de negocio avanzada.
+    1. Reutiliza los PDFs pre-renderizados por /verificar-cedula si las entradas coinciden.
+    2. Si no, busca TODOS los registros por cédula y genera un PDF por empresa canónica.
+    3. Sube cada PDF a Google Drive.
+    4. Devuelve enlaces a todos los archivos subidos.
+    """
+    # 1. Intentar reutilizar el pre-renderizado especulativo
+    certificados = None
+    if settings.PRERENDER_ENABLED:
+        with etapa("prerender"):
+            certificados = prerender_cache.tomar(
+                cedula,
+                clave_prerender(tipo_contrato, salario_manual),
+                timeout=settings.PRERENDER_WAIT_SECONDS
+            )
+
+    # 2. Generar en línea si no hubo pre-renderizado utilizable
+    if certificados is None:
+        with etapa("sheets"):
+            records = sheets_service.get_records_by_cedula(cedula)
+            if not records:
+                raise HTTPException(status_code=404, detail=f"No se encontró ningún registro para la cédula {cedula}")
+
+            company_info_lookup = sheets_service.get_company_info_lookup()
+
+        with etapa("render"):
+            certificados = renderizar_certificados(cedula, records, company_info_lookup, tipo_contrato, salario_manual)
+
+    # 3. Subir cada certificado a Google Drive
+    generated_files = []
+    for certificado in certificados:
+        if "error" in certificado:
+            generated_files.append({
+                "empresa": certificado["empresa"],
+                "filename": f"Error: {certificado['error']}",
+                "link": None
+            })
+            continue
+
+        try:
+            with etapa("upload"):
+                file_info = drive_service.upload_pdf(certificado["pdf_bytes"], certificado["filename"], empresa=certificado["empresa"])
             view_link = file_info.get("webViewLink")
             
             generated_files.append({
-                "empresa": canonical_company_name,
-                "filename": pdf_filename,
+                "empresa": certificado["empresa"],
+                "filename": certificado["filename"],
                 "link": view_link
             })
             
         except Exception as e:
             # Si hay error con una empresa, continuar con las otras
             generated_files.append({
-                "empresa": canonical_company_name,
+                "empresa": certificado["empresa"],
                 "filename": f"Error: {str(e)}",
                 "link": None
             })
 
-    # 5. Generar respuesta con todos los enlaces
+    # 4. Generar respuesta con todos los enlaces
     if not generated_files:
         raise HTTPException(status_code=500, detail="No se pudo generar ningún certificado")
     
-    # --- INICIO DEL BLOQUE DE RESPUESTA HTML MEJORADO ---
-    
-    file_list_html = ""
-    success_count = 0
-    
-    for file_info in generated_files:
-        if file_info["link"]:
-            success_count += 1
-            file_list_html += f"""
-                <li class="success">
-                    <span class="icon">📄</span>
-                    <div class="details">
-                        <strong>{file_info["empresa"]}</strong>
-                        <span>{file_info["filename"]}</span>
-                    </div>
-                    <a href="{file_info['link']}" target="_blank" class="download-link">Ver / Descargar</a>
-                </li>
-            """
-        else:
-            file_list_html += f"""
-                <li class="error">
-                    <span class="icon">❌</span>
-                    <div class="details">
-                        <strong>{file_info["empresa"]}</strong>
-                        <span>{file_info["filename"]}</span>
-                    </div>
-                </li>
-            """
+    success_count = sum(1 for file_info in generated_files if file_info["link"])
 
-    return HTMLResponse(content=f"""
-        <!doctype html>
-        <html>
-            <head>
-                <meta charset="utf-8">
-                <title>Certificados Generados</title>
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        background-color: #f5f5f5;
-                        margin: 0;
-                        padding: 40px 20px;
-                        display: flex;
-                        justify-content: center;
-                        align-items: flex-start;
-                        min-height: 100vh;
-                    }}
-                    .container {{
-                        background-color: white;
-                        max-width: 700px;
-                        width: 100%;
-                        padding: 30px 40px;
-                        border-radius: 10px;
-                        box-shadow: 0 4px 20px rgba(0,0,0,0.1);
-                        text-align: center;
-                    }}
-                    h1 {{
-                        color: #4CAF50;
-                        font-size: 28px;
-                        margin-bottom: 10px;
-                        display: flex;
-                        align-items: center;
-                        justify-content: center;
-                        gap: 10px;
-                    }}
-                    .summary {{
-                        color: #555;
-                        font-size: 18px;
-                        margin-bottom: 30px;
-                    }}
-                    ul {{
-                        list-style-type: none;
-                        padding: 0;
-                        margin: 0;
-                    }}
-                    li {{
-                        display: flex;
-                        align-items: center;
-                        text-align: left;
-                        padding: 15px;
-                        margin-bottom: 15px;
-                        border-radius: 8px;
-                        border: 1px solid #ddd;
-                        transition: box-shadow 0.2s;
-                    }}
-                    li:hover {{
-                        box-shadow: 0 2px 10px rgba(0,0,0,0.08);
-                    }}
-                    li.success {{
-                        border-left: 5px solid #4CAF50;
-                    }}
-                    li.error {{
-                        border-left: 5px solid #d32f2f;
-                        background-color: #ffebee;
-                    }}
-                    .icon {{
-                        font-size: 24px;
-                        margin-right: 15px;
-                    }}
-                    .details {{
-                        display: flex;
-                        flex-direction: column;
-                        flex-grow: 1;
-                    }}
-                    .details strong {{
-                        color: #333;
-                        font-size: 16px;
-                    }}
-                    .details span {{
-                        color: #777;
-                        font-size: 13px;
-                        word-break: break-all;
-                    }}
-                    .download-link {{
-                        background-color: #e8f5e8;
-                        color: #4CAF50;
-                        padding: 8px 15px;
-                        border-radius: 20px;
-                        text-decoration: none;
-                        font-weight: bold;
-                        font-size: 14px;
-                        white-space: nowrap;
-                        transition: background-color 0.2s;
-                    }}
-                    .download-link:hover {{
-                        background-color: #d1e7d2;
-                    }}
-                    .btn-back {{
-                        display: inline-block;
-                        margin-top: 30px;
-                        background-color: #4CAF50;
-                        color: white;
-                        padding: 12px 30px;
-                        border: none;
-                        border-radius: 5px;
-                        cursor: pointer;
-                        font-size: 16px;
-                        text-decoration: none;
-                        transition: background-color 0.2s;
-                    }}
-                    .btn-back:hover {{
-                        background-color: #45a049;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1><span class="icon-title">✅</span>Proceso Completado</h1>
-                    <p class="summary">Se generaron <strong>{success_count}</strong> certificados con éxito.</p>
-                    <ul>
-                        {file_list_html}
-                    </ul>
-                    <a href="/" class="btn-back">Generar Otros Certificados</a>
-                </div>
-            </body>
-        </html>
-    """)
-    # --- FIN DEL BLOQUE DE RESPUESTA HTML MEJORADO ---
\ No newline at end of file
+    return templates.TemplateResponse(request, "resultado.html", {
+        "archivos": generated_files,
+        "success_count": success_count
+    })
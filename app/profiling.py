@@ -0,0 +1,166 @@
+import functools
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
+from app.config import settings
+
+
+class _RegistroSolicitud:
+    """Tiempos de una solicitud observada por el middleware de perfilado."""
+
+    def __init__(self, metodo: str, ruta: str, muestreado: bool):
+        self.metodo = metodo
+        self.ruta = ruta
+        self.muestreado = muestreado
+        self.inicio = datetime.now()
+        self.etapas: Dict[str, float] = {}
+        self.profiler: Optional[Profiler] = None
+
+    def sumar_etapa(self, nombre: str, segundos: float):
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+
+_registro_actual: ContextVar[Optional[_RegistroSolicitud]] = ContextVar("registro_perfilado", default=None)
+_recientes: deque = deque(maxlen=settings.PROFILING_MAX_RECENT)
+_recientes_lock = threading.Lock()
+
+
+@contextmanager
+def etapa(nombre: str):
+    """
+    Mide una etapa de la solicitud en curso (p. ej. "sheets", "render", "upload").
+    No hace nada si la solicitud no está siendo observada.
+    """
+    registro = _registro_actual.get()
+    if registro is None:
+        yield
+        return
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro.sumar_etapa(nombre, time.perf_counter() - inicio)
+
+
+def perfilable(func):
+    """
+    Perfila el endpoint síncrono si su solicitud fue muestreada.
+
+    Los endpoints síncronos corren en el threadpool de Starlette y pyinstrument
+    solo muestrea el hilo donde se inicia, así que el perfilador se arranca aquí,
+    dentro del hilo del endpoint, y no en el middleware.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        registro = _registro_actual.get()
+        if registro is None or not registro.muestreado:
+            return func(*args, **kwargs)
+
+        profiler = Profiler(interval=settings.PROFILING_INTERVAL)
+        profiler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.stop()
+            registro.profiler = profiler
+
+    return wrapper
+
+
+def token_valido(request: Request) -> bool:
+    """Indica si la solicitud trae en PROFILING_HEADER el PROFILING_TOKEN configurado."""
+    token = settings.PROFILING_TOKEN
+    if not token:
+        return False
+    recibido = request.headers.get(settings.PROFILING_HEADER, "")
+    return hmac.compare_digest(recibido.encode("utf-8"), token.encode("utf-8"))
+
+
+def _guardar_perfil(registro: _RegistroSolicitud, duracion: float) -> str:
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    ruta_segura = re.sub(r'[^A-Za-z0-9]+', '_', registro.ruta).strip('_') or "raiz"
+    nombre = f"{registro.inicio.strftime('%Y%m%d_%H%M%S_%f')}_{ruta_segura}_{int(duracion * 1000)}ms.speedscope.json"
+    destino = os.path.join(settings.PROFILING_DIR, nombre)
+    with open(destino, "w", encoding="utf-8") as f:
+        f.write(registro.profiler.output(SpeedscopeRenderer()))
+    _podar_perfiles()
+    return destino
+
+
+def _podar_perfiles():
+    """Conserva solo los PROFILING_MAX_RECENT perfiles más recientes en disco."""
+    # El nombre empieza por la fecha de inicio, así que el orden alfabético es cronológico
+    perfiles = sorted(
+        nombre for nombre in os.listdir(settings.PROFILING_DIR)
+        if nombre.endswith(".speedscope.json")
+    )
+    for nombre in perfiles[:-settings.PROFILING_MAX_RECENT]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, nombre))
+        except FileNotFoundError:
+            # Otro hilo ya lo borró
+            pass
+
+
+async def middleware_perfilado(request: Request, call_next):
+    """
+    Middleware HTTP de perfilado opcional.
+
+    Se activa con PROFILING_ENABLED (muestreando PROFILING_SAMPLE_RATE de las
+    solicitudes) o, para una solicitud concreta, enviando la cabecera
+    PROFILING_HEADER con el valor de PROFILING_TOKEN.
+    """
+    forzado = token_valido(request)
+    if not (settings.PROFILING_ENABLED or forzado) or request.url.path.startswith(("/static", "/admin")):
+        return await call_next(request)
+
+    muestreado = forzado or random.random() < settings.PROFILING_SAMPLE_RATE
+    registro = _RegistroSolicitud(request.method, request.url.path, muestreado)
+    token_contexto = _registro_actual.set(registro)
+    inicio = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        duracion = time.perf_counter() - inicio
+        _registro_actual.reset(token_contexto)
+
+    archivo = None
+    if registro.profiler is not None:
+        try:
+            archivo = await run_in_threadpool(_guardar_perfil, registro, duracion)
+        except Exception as e:
+            # El perfilado nunca debe romper la respuesta
+            print(f"Error al guardar el perfil de {registro.ruta}: {e}")
+
+    with _recientes_lock:
+        _recientes.append({
+            "metodo": registro.metodo,
+            "ruta": registro.ruta,
+            "inicio": registro.inicio.isoformat(timespec="seconds"),
+            "status": response.status_code,
+            "duracion_ms": round(duracion * 1000, 1),
+            "etapas_ms": {nombre: round(segundos * 1000, 1) for nombre, segundos in registro.etapas.items()},
+            "perfil": archivo,
+        })
+
+    return response
+
+
+def solicitudes_mas_lentas(limite: int = 20) -> List[Dict]:
+    """Devuelve las solicitudes recientes ordenadas de la más lenta a la más rápida."""
+    with _recientes_lock:
+        recientes = list(_recientes)
+    return sorted(recientes, key=lambda r: r["duracion_ms"], reverse=True)[:limite]
@@ -1,16 +1,247 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
 from io import BytesIO
+from typing import Dict, List, Optional
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 from app.google_clients import get_drive_service
 from app.config import settings
 
-def upload_pdf(file_stream: BytesIO, filename: str):
-    drive = get_drive_service()
-    media = MediaIoBaseUpload(file_stream, mimetype="application/pdf")
-    metadata = {"name": filename, "parents": [settings.DRIVE_FOLDER_ID]}
-    file = drive.files().create(
-        body=metadata,
-        media_body=media,
-        fields="id, webViewLink",
-        supportsAllDrives=True  # <- AÑADE ESTA LÍNEA
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+
+# Cache en proceso de IDs de carpetas, persistida en DRIVE_FOLDER_CACHE_PATH.
+# Clave: "<id carpeta padre>/<nombre subcarpeta>" -> id de la subcarpeta
+_folder_cache: Optional[Dict[str, str]] = None
+_folder_cache_lock = threading.Lock()
+# Un lock por clave de la cache para serializar solo la creación de esa carpeta
+_folder_key_locks: Dict[str, threading.Lock] = {}
+
+
+def _load_cache() -> Dict[str, str]:
+    global _folder_cache
+    if _folder_cache is None:
+        try:
+            with open(settings.DRIVE_FOLDER_CACHE_PATH, "r", encoding="utf-8") as f:
+                _folder_cache = json.load(f)
+        except (OSError, ValueError):
+            _folder_cache = {}
+    return _folder_cache
+
+
+def _save_cache():
+    # Escritura atómica para no dejar un JSON a medias si el proceso muere
+    tmp_path = f"{settings.DRIVE_FOLDER_CACHE_PATH}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_folder_cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, settings.DRIVE_FOLDER_CACHE_PATH)
+    except OSError as e:
+        # Sin persistencia la cache sigue funcionando en memoria
+        print(f"No se pudo guardar la cache de carpetas de Drive: {e}")
+
+
+def shard_path(empresa: Optional[str] = None, fecha: Optional[datetime] = None) -> List[str]:
+    """
+    Devuelve la ruta de subcarpetas (relativa a DRIVE_FOLDER_ID) donde va un certificado.
+
+    Según DRIVE_SHARDING:
+        "fecha":   ["2025", "08"]
+        "empresa": ["CORPORACION HACIA UN VALLE SOLIDARIO"]
+        "ninguno": [] (todo en la carpeta raíz)
+    """
+    modo = settings.DRIVE_SHARDING
+    if modo == "ninguno":
+        return []
+    if modo == "empresa":
+        return [empresa or "Empresa No Especificada"]
+    if modo == "fecha":
+        fecha = fecha or datetime.now()
+        return [f"{fecha.year:04d}", f"{fecha.month:02d}"]
+    raise ValueError(f"DRIVE_SHARDING desconocido: {modo}")
+
+
+def _find_or_create_folder(drive, nombre: str, padre_id: str) -> str:
+    nombre_q = nombre.replace("\\", "\\\\").replace("'", "\\'")
+    query = (
+        f"name = '{nombre_q}' and '{padre_id}' in parents "
+        f"and mimeType = '{FOLDER_MIMETYPE}' and trashed = false"
+    )
+    encontrados = drive.files().list(
+        q=query,
+        fields="files(id)",
+        pageSize=1,
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True
+    ).execute().get("files", [])
+    if encontrados:
+        return encontrados[0]["id"]
+
+    carpeta = drive.files().create(
+        body={"name": nombre, "mimeType": FOLDER_MIMETYPE, "parents": [padre_id]},
+        fields="id",
+        supportsAllDrives=True
     ).execute()
-    return file
+    return carpeta["id"]
+
+
+def _key_lock(clave: str) -> threading.Lock:
+    with _folder_cache_lock:
+        return _folder_key_locks.setdefault(clave, threading.Lock())
+
+
+def resolve_folder(drive, path: List[str]) -> str:
+    """
+    Resuelve (creando si hace falta) la ruta de subcarpetas bajo DRIVE_FOLDER_ID.
+    Con la cache caliente no hace ninguna llamada a la API.
+    """
+    padre_id = settings.DRIVE_FOLDER_ID
+    for nombre in path:
+        clave = f"{padre_id}/{nombre}"
+        with _folder_cache_lock:
+            carpeta_id = _load_cache().get(clave)
+
+        if carpeta_id is None:
+            # El lock por carpeta evita crearla dos veces sin frenar las subidas
+            # que van a otras carpetas mientras se llama a la API de Drive
+            with _key_lock(clave):
+                with _folder_cache_lock:
+                    carpeta_id = _load_cache().get(clave)
+                if carpeta_id is None:
+                    carpeta_id = _find_or_create_folder(drive, nombre, padre_id)
+                    with _folder_cache_lock:
+                        _load_cache()[clave] = carpeta_id
+                        _save_cache()
+        padre_id = carpeta_id
+    return padre_id
+
+
+def _invalidate_path(path: List[str]):
+    """Olvida las carpetas de la ruta (p. ej. si alguien las borró en Drive)."""
+    padre_id = settings.DRIVE_FOLDER_ID
+    with _folder_cache_lock:
+        cache = _load_cache()
+        for nombre in path:
+            carpeta_id = cache.pop(f"{padre_id}/{nombre}", None)
+            if carpeta_id is None:
+                break
+            padre_id = carpeta_id
+        _save_cache()
+
+
+def upload_pdf(file_stream: BytesIO, filename: str, empresa: Optional[str] = None):
+    drive = get_drive_service()
+    path = shard_path(empresa)
+
+    for intento in range(2):
+        parent_id = resolve_folder(drive, path)
+        media = MediaIoBaseUpload(file_stream, mimetype="application/pdf")
+        metadata = {"name": filename, "parents": [parent_id]}
+        try:
+            file = drive.files().create(
+                body=metadata,
+                media_body=media,
+                fields="id, webViewLink",
+                supportsAllDrives=True  # <- AÑADE ESTA LÍNEA
+            ).execute()
+            return file
+        except HttpError as e:
+            # Carpeta cacheada que ya no existe: se invalida y se reintenta una vez
+            if e.resp.status != 404 or intento == 1 or not path:
+                raise
+            _invalidate_path(path)
+            file_stream.seek(0)
+
+
+def _company_from_filename(filename: str, company_names: List[str]) -> Optional[str]:
+    # main.py nombra los archivos Certificado_<nombre>_<empresa>_<cedula>.pdf
+    for company in sorted(company_names, key=len, reverse=True):
+        company_safe = company.replace(' ', '_').replace(',', '').replace('/', '_')
+        if re.search(rf"_{re.escape(company_safe)}_[^_]+\.pdf$", filename):
+            return company
+    return None
+
+
+def migrate_flat_folder(dry_run: bool = False) -> Dict[str, int]:
+    """
+    Mueve los certificados que están sueltos en DRIVE_FOLDER_ID a sus subcarpetas
+    según DRIVE_SHARDING. En modo "fecha" usa la fecha de creación del archivo;
+    en modo "empresa" deduce la empresa del nombre del archivo y deja en su
+    sitio los que no se pueden asignar.
+
+    Returns:
+        Conteo de archivos {"movidos": ..., "sin_asignar": ...}
+    """
+    drive = get_drive_service()
+    root_id = settings.DRIVE_FOLDER_ID
+
+    company_names: List[str] = []
+    if settings.DRIVE_SHARDING == "empresa":
+        from app.services import sheets_service
+        company_names = list({info["canonical_name"] for info in sheets_service.get_company_info_lookup().values()})
+
+    # Se lista todo antes de mover: sacar archivos de la carpeta mientras se
+    # pagina sobre ella podría saltarse páginas
+    archivos = []
+    page_token = None
+    query = f"'{root_id}' in parents and mimeType != '{FOLDER_MIMETYPE}' and trashed = false"
+    while True:
+        respuesta = drive.files().list(
+            q=query,
+            fields="nextPageToken, files(id, name, createdTime)",
+            pageSize=1000,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+        archivos.extend(respuesta.get("files", []))
+        page_token = respuesta.get("nextPageToken")
+        if not page_token:
+            break
+
+    conteo = {"movidos": 0, "sin_asignar": 0}
+    for archivo in archivos:
+        empresa = None
+        if settings.DRIVE_SHARDING == "empresa":
+            empresa = _company_from_filename(archivo["name"], company_names)
+            if empresa is None:
+                conteo["sin_asignar"] += 1
+                print(f"Sin empresa reconocible, se deja en la raíz: {archivo['name']}")
+                continue
+
+        # createdTime viene en UTC; shard_path usa la hora local igual que las subidas en vivo
+        fecha = datetime.fromisoformat(archivo["createdTime"].replace("Z", "+00:00")).astimezone()
+        path = shard_path(empresa, fecha)
+        if not path:
+            conteo["sin_asignar"] += 1
+            continue
+
+        print(f"{'[dry-run] ' if dry_run else ''}{archivo['name']} -> {'/'.join(path)}")
+        if not dry_run:
+            drive.files().update(
+                fileId=archivo["id"],
+                addParents=resolve_folder(drive, path),
+                removeParents=root_id,
+                fields="id",
+                supportsAllDrives=True
+            ).execute()
+        conteo["movidos"] += 1
+
+    return conteo
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.services.drive_service migrar [--dry-run]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Utilidades de la carpeta de certificados en Drive")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    migrar = subparsers.add_parser("migrar", help="Reparte la carpeta plana en subcarpetas según DRIVE_SHARDING")
+    migrar.add_argument("--dry-run", action="store_true", help="Solo muestra lo que se movería")
+    args = parser.parse_args()
+
+    if args.comando == "migrar":
+        resultado = migrate_flat_folder(dry_run=args.dry_run)
+        print(f"Movidos: {resultado['movidos']}  Sin asignar: {resultado['sin_asignar']}")
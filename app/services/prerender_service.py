@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+from app.config import settings
+
+
+class PrerenderCancelado(Exception):
+    """Se lanza dentro de un renderizado especulativo cuando sus entradas ya no sirven."""
+
+
+class _Trabajo:
+    def __init__(self, clave: Tuple, future: Future, cancelado: threading.Event):
+        self.clave = clave
+        self.future = future
+        self.cancelado = cancelado
+        self.creado = time.monotonic()
+
+    def cancelar(self):
+        self.cancelado.set()
+        self.future.cancel()
+
+
+class PrerenderCache:
+    """
+    Cache acotada de certificados pre-renderizados de forma especulativa.
+
+    Guarda como máximo un trabajo por cédula y `max_entries` cédulas en total;
+    al superar el límite se descarta (y cancela) la cédula más antigua.
+    Cada resultado se entrega una sola vez: `tomar` lo retira de la cache.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_workers: int = 2):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prerender")
+        self._trabajos: "OrderedDict[str, _Trabajo]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def programar(self, cedula: str, clave: Tuple, render: Callable[[threading.Event], List[Dict]]) -> None:
+        """
+        Lanza `render` en segundo plano para la cédula con las entradas `clave`.
+        `render` recibe un `threading.Event` que se activa si el trabajo se cancela.
+        """
+        with self._lock:
+            anterior = self._trabajos.pop(cedula, None)
+            if anterior is not None:
+                if anterior.clave == clave and not self._expirado(anterior):
+                    # Ya hay un renderizado en curso (o listo) con las mismas entradas
+                    self._trabajos[cedula] = anterior
+                    return
+                anterior.cancelar()
+
+            cancelado = threading.Event()
+            future = self._executor.submit(render, cancelado)
+            self._trabajos[cedula] = _Trabajo(clave, future, cancelado)
+
+            while len(self._trabajos) > self.max_entries:
+                _, descartado = self._trabajos.popitem(last=False)
+                descartado.cancelar()
+
+    def tomar(self, cedula: str, clave: Tuple, timeout: Optional[float] = None) -> Optional[List[Dict]]:
+        """
+        Devuelve los certificados pre-renderizados si las entradas coinciden.
+        Si no coinciden, cancela el trabajo especulativo y devuelve None.
+        """
+        with self._lock:
+            trabajo = self._trabajos.pop(cedula, None)
+
+        if trabajo is None:
+            return None
+        if trabajo.clave != clave or self._expirado(trabajo):
+            trabajo.cancelar()
+            return None
+
+        # Si el trabajo sigue en cola esperar solo añadiría latencia: se cancela y
+        # se renderiza en línea. Solo se espera el trabajo que ya está en marcha.
+        if not (trabajo.future.running() or trabajo.future.done()):
+            trabajo.cancelar()
+            return None
+
+        try:
+            return trabajo.future.result(timeout=timeout)
+        except (CancelledError, PrerenderCancelado):
+            return None
+        except FutureTimeoutError:
+            # Tarda demasiado: se abandona y se renderiza en línea
+            trabajo.cancelar()
+            return None
+        except Exception as e:
+            # El renderizado especulativo nunca debe romper la petición real
+            print(f"Error en el pre-renderizado de la cédula {cedula}: {e}")
+            trabajo.cancelar()
+            return None
+
+    def _expirado(self, trabajo: _Trabajo) -> bool:
+        return time.monotonic() - trabajo.creado > self.ttl_seconds
+
+
+prerender_cache = PrerenderCache(
+    max_entries=settings.PRERENDER_MAX_ENTRIES,
+    ttl_seconds=settings.PRERENDER_TTL_SECONDS,
+    max_workers=settings.PRERENDER_MAX_WORKERS,
+)
@@ -1,11 +1,77 @@
 import os
+import time
+from functools import lru_cache
 from io import BytesIO
+from typing import Dict, Optional
+from PIL import Image as PILImage
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
 from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer, Image
 
+# --- OPTIMIZACIÓN DE SALIDA ---
+# Tamaño con el que se dibuja la firma en el certificado
+FIRMA_ANCHO = 3.2 * inch
+FIRMA_ALTO = 0.7 * inch
+# Resolución máxima a la que se reduce la firma antes de incrustarla
+FIRMA_DPI = 150
+FIRMA_CALIDAD_JPEG = 85
+
+# Opciones de BaseDocTemplate por perfil de salida.
+# "pdfa" aplica los ajustes orientados a archivo que ReportLab (versión libre)
+# permite: espacio de color RGB, idioma y metadatos. Las fechas de creación y
+# modificación se conservan reales, ya que son certificados fechados.
+PERFILES_PDF = {
+    "estandar": {
+        "pageCompression": 1,
+    },
+    "pdfa": {
+        "pageCompression": 1,
+        "enforceColorSpace": "rgb",
+        "lang": "es-CO",
+        "title": "Certificado Laboral",
+        "author": "Departamento Gestión Humana",
+        "subject": "Certificado laboral",
+        "creator": "Generador de Certificados Laborales",
+    },
+}
+
+def _ruta_firma() -> str:
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return os.path.join(base_dir, 'firma', 'firma.png')
+
+@lru_cache(maxsize=1)
+def preparar_firma() -> Optional[bytes]:
+    """
+    Prepara una sola vez la firma optimizada para incrustar en los PDFs.
+
+    Aplana la transparencia sobre fondo blanco, la reduce a FIRMA_DPI para el
+    tamaño en que se dibuja (sin ampliarla nunca) y la recodifica como JPEG,
+    que ReportLab incrusta tal cual sin volver a comprimirla.
+
+    Returns:
+        Bytes JPEG de la firma, o None si no existe el archivo.
+    """
+    firma_path = _ruta_firma()
+    if not os.path.exists(firma_path):
+        return None
+
+    with PILImage.open(firma_path) as original:
+        firma = original.convert("RGBA")
+        fondo = PILImage.new("RGB", firma.size, (255, 255, 255))
+        fondo.paste(firma, mask=firma.getchannel("A"))
+
+    ancho_max = round(FIRMA_ANCHO / inch * FIRMA_DPI)
+    alto_max = round(FIRMA_ALTO / inch * FIRMA_DPI)
+    nuevo_tamano = (min(fondo.width, ancho_max), min(fondo.height, alto_max))
+    if nuevo_tamano != fondo.size:
+        fondo = fondo.resize(nuevo_tamano, PILImage.LANCZOS)
+
+    salida = BytesIO()
+    fondo.save(salida, "JPEG", quality=FIRMA_CALIDAD_JPEG, optimize=True)
+    return salida.getvalue()
+
 # --- FUNCIÓN DE DIBUJO ESTÁTICO (MINIMALISTA) ---
 def draw_static_elements(canvas, doc):
     canvas.saveState()
@@ -32,7 +98,19 @@ def draw_static_elements(canvas, doc):
     
     canvas.restoreState()
 
-def generar_certificado_en_memoria(datos: dict) -> BytesIO:
+def generar_certificado_en_memoria(datos: dict, perfil: str = "estandar", optimizar: bool = True) -> BytesIO:
+    """
+    Genera el certificado en memoria.
+
+    Args:
+        datos: Datos de la plantilla preparados en main.py
+        perfil: Perfil de salida de PERFILES_PDF ("estandar" o "pdfa")
+        optimizar: Si es False usa la firma original y las opciones por defecto
+            de ReportLab (sirve como referencia en comparar_optimizacion)
+    """
+    if perfil not in PERFILES_PDF:
+        raise ValueError(f"Perfil de PDF desconocido: {perfil}")
+
     buf = BytesIO()
     doc = BaseDocTemplate(
         buf,
@@ -40,7 +118,8 @@ def generar_certificado_en_memoria(datos: dict) -> BytesIO:
         topMargin=inch,
         bottomMargin=inch,
         leftMargin=inch,
-        rightMargin=inch
+        rightMargin=inch,
+        **(PERFILES_PDF[perfil] if optimizar else {})
     )
     doc.datos = datos
     content_frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='content')
@@ -149,14 +228,16 @@ def generar_certificado_en_memoria(datos: dict) -> BytesIO:
 
     # --- INICIO DEL BLOQUE MODIFICADO ---
     try:
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        firma_path = os.path.join(base_dir, 'firma', 'firma.png')
-
-        if os.path.exists(firma_path):
-            # --- LÍNEA CORREGIDA ---
-            # Se quita el argumento 'preserveAspectRatio' y 'height'.
-            # Al dar solo el ancho, la altura se ajusta automáticamente manteniendo la proporción.
-            firma_img = Image(firma_path, width=3.2*inch, height=0.7*inch)  # Ajusta el tamaño según sea necesario
+        if optimizar:
+            firma_jpeg = preparar_firma()
+            # Cada documento necesita su propio stream sobre los bytes compartidos
+            firma_origen = BytesIO(firma_jpeg) if firma_jpeg else None
+        else:
+            firma_path = _ruta_firma()
+            firma_origen = firma_path if os.path.exists(firma_path) else None
+
+        if firma_origen is not None:
+            firma_img = Image(firma_origen, width=FIRMA_ANCHO, height=FIRMA_ALTO)
             firma_img.hAlign = 'LEFT'
             story.append(firma_img)
         else:
@@ -176,4 +257,54 @@ def generar_certificado_en_memoria(datos: dict) -> BytesIO:
 
     doc.build(story)
     buf.seek(0)
-    return buf
\ No newline at end of file
+    return buf
+
+def comparar_optimizacion(datos: dict, repeticiones: int = 10, perfil: str = "estandar") -> Dict[str, Dict[str, float]]:
+    """
+    Compara tamaño en bytes y tiempo medio de renderizado con y sin la etapa
+    de optimización de salida.
+
+    Returns:
+        {"antes": {"bytes": ..., "ms": ...}, "despues": {"bytes": ..., "ms": ...}}
+    """
+    resultado = {}
+    for etiqueta, optimizar in (("antes", False), ("despues", True)):
+        # Primer render fuera de la medición (carga de fuentes y de la firma)
+        pdf = generar_certificado_en_memoria(datos, perfil=perfil, optimizar=optimizar)
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            pdf = generar_certificado_en_memoria(datos, perfil=perfil, optimizar=optimizar)
+        transcurrido = time.perf_counter() - inicio
+        resultado[etiqueta] = {
+            "bytes": len(pdf.getvalue()),
+            "ms": transcurrido / repeticiones * 1000,
+        }
+    return resultado
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.services.template [estandar|pdfa]
+    import sys
+
+    datos_ejemplo = {
+        "nombre": "NOMBRE DE EJEMPLO",
+        "cedula": "12345678",
+        "periodos_cerrados_html": "• Desde el 1 de enero de 2020 hasta el 31 de diciembre de 2021 en el cargo de MANIPULADORA",
+        "periodo_activo_data": {"fecha_ingreso": "1 de febrero de 2024", "cargo": "MANIPULADORA ALIMENTOS"},
+        "cargo": "MANIPULADORA ALIMENTOS",
+        "salario_num": "$2,400,000",
+        "salario_letras": "Dos millones cuatrocientos mil pesos",
+        "texto_adicional": "en el programa de alimentación escolar PAE.",
+        "nombre_empresa": "CORPORACION HACIA UN VALLE SOLIDARIO",
+        "nit_empresa": "805.029.170-0",
+        "extra_top_margin": False,
+        "tipo_contrato": "de Obra o Labor contratada",
+        "dias_texto": "uno",
+        "dias_numero": "1",
+        "mes": "enero",
+        "año": "2025",
+    }
+    perfil_cli = sys.argv[1] if len(sys.argv) > 1 else "estandar"
+    medidas = comparar_optimizacion(datos_ejemplo, perfil=perfil_cli)
+    for etiqueta, medida in medidas.items():
+        print(f"{etiqueta:>8}: {medida['bytes']:>8} bytes  {medida['ms']:.1f} ms")
@@ -0,0 +1,40 @@
+import hashlib
+import os
+from functools import lru_cache
+from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
+
+STATIC_DIR = "app/static"
+
+# Recursos pedidos con ?v=<hash> nunca cambian bajo esa URL: caché de un año
+CACHE_VERSIONADO = "public, max-age=31536000, immutable"
+# Sin versión (p. ej. la imagen de fondo del formulario) se revalida con el ETag a diario
+CACHE_SIN_VERSION = "public, max-age=86400"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles con cabeceras Cache-Control de larga duración.
+    El ETag y Last-Modified ya los añade FileResponse de Starlette.
+    """
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        query = scope.get("query_string", b"")
+        versionado = any(parte.startswith(b"v=") for parte in query.split(b"&"))
+        response.headers["Cache-Control"] = CACHE_VERSIONADO if versionado else CACHE_SIN_VERSION
+        return response
+
+
+@lru_cache(maxsize=None)
+def _version_estatico(ruta: str) -> str:
+    with open(os.path.join(STATIC_DIR, ruta), "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()[:10]
+
+
+def url_estatico(ruta: str) -> str:
+    """
+    URL de un archivo de app/static con su hash de contenido como versión,
+    para poder cachearlo indefinidamente en el navegador.
+    """
+    return f"/static/{ruta}?v={_version_estatico(ruta)}"